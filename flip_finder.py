@@ -15,28 +15,131 @@ Then shows the top N items by margin.
 
 from __future__ import annotations
 
+import functools
 import sqlite3
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 import pandas as pd
 
 
 DEFAULT_DB_PATH = Path(__file__).with_name("osrs_prices.db")
 
+# Statements run by GlobalFlipFinder.
+MAX_SCAN_TS_SQL = "SELECT MAX(scan_ts) FROM prices"
+
+# Latest row per item within the window. The inner MAX(scan_ts) per item
+# is answered from idx_prices_item_ts alone; only the winning rows are then
+# fetched from prices. Items whose latest scan lacks a price are dropped.
+LATEST_SNAPSHOT_SQL = """
+    SELECT
+        p.item_id,
+        p.scan_ts,
+        p.high,
+        p.low,
+        i.name
+    FROM prices p
+    JOIN (
+        SELECT item_id, MAX(scan_ts) AS max_ts
+        FROM prices
+        WHERE scan_ts >= ?
+        GROUP BY item_id
+    ) latest
+      ON p.item_id = latest.item_id
+     AND p.scan_ts = latest.max_ts
+    JOIN items i
+      ON p.item_id = i.id
+    WHERE p.high IS NOT NULL
+      AND p.low  IS NOT NULL
+"""
+
+# OSRS prices are capped at 2,147,483,647 GP (max cash stack), so every
+# price and margin fits in a signed 32-bit int; halving the width keeps
+# the frames smaller for downstream passes. roi_pct stays float64: float32
+# loses the second decimal on large ROIs (e.g. low=7 GP).
+SNAPSHOT_DTYPES = {
+    "item_id": "int64",
+    "scan_ts": "int64",
+    "high": "Int32",
+    "low": "Int32",
+}
+
+FLIP_TABLE_DTYPES = {
+    "current_high": "Int32",
+    "current_low": "Int32",
+    "margin": "Int32",
+    "roi_pct": "float64",
+}
+
+# Margin / ROI on top of the latest snapshot, filtered and ranked in SQL so
+# only the top rows ever leave the DB. LIMIT -1 means "no limit".
+FLIP_TABLE_SQL = f"""
+    SELECT
+        name,
+        high                        AS current_high,
+        low                         AS current_low,
+        (high - low)                AS margin,
+        (high - low) * 100.0 / low  AS roi_pct
+    FROM ({LATEST_SNAPSHOT_SQL}) latest
+    WHERE low  > 0
+      AND high > low
+    ORDER BY margin DESC
+    LIMIT ?
+"""
+
 
 class GlobalFlipFinder:
     """Compute simple flip stats from the latest prices in the DB."""
 
     def __init__(self, db_path: str | Path = DEFAULT_DB_PATH) -> None:
         self.db_path = Path(db_path)
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
+        # Autocommit mode: reads are grouped explicitly via _read_txn()
+        # instead of the module's implicit transaction handling.
+        self.conn = sqlite3.connect(
+            self.db_path,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.conn.execute("PRAGMA query_only=ON;")
+        self.conn.execute("PRAGMA mmap_size=268435456;")  # 256 MiB
+        self.conn.execute("PRAGMA cache_size=-131072;")  # 128 MiB
+        self._cur = self.conn.cursor()
+
+        # Flip tables keyed on (max_scan_ts, since_minutes, top_n); a new
+        # snapshot bumps max_scan_ts, so stale entries are never hit.
+        self._flip_table_cache = functools.lru_cache(maxsize=8)(
+            self._query_flip_table
+        )
 
     # ------------------------------------------------------------------ #
     # Helpers                                                            #
     # ------------------------------------------------------------------ #
 
+    @contextmanager
+    def _read_txn(self) -> Iterator[None]:
+        """
+        Run the enclosed queries in one deferred read transaction so they
+        all see the same snapshot of the DB.
+        """
+        self.conn.execute("BEGIN DEFERRED")
+        try:
+            yield
+        except BaseException:
+            # pandas may already have rolled back on a failed query.
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _get_max_scan_ts(self) -> Optional[int]:
+        """
+        Most recent scan_ts in the prices table, or None if it is empty.
+        """
+        self._cur.execute(MAX_SCAN_TS_SQL)
+        (max_ts,) = self._cur.fetchone()
+        return max_ts
+
     def _get_window_start(self, since_minutes: int) -> Optional[int]:
         """
         Get the earliest scan_ts we care about based on the most recent
@@ -45,13 +148,10 @@ class GlobalFlipFinder:
         Returns:
             window_start (int) or None if prices table is empty.
         """
-        cur = self.conn.cursor()
-        cur.execute("SELECT MAX(scan_ts) AS max_ts FROM prices")
-        row = cur.fetchone()
-        if not row or row["max_ts"] is None:
+        max_ts = self._get_max_scan_ts()
+        if max_ts is None:
             return None
 
-        max_ts = row["max_ts"]
         return max_ts - since_minutes * 60
 
     def load_latest_snapshot(self, since_minutes: int = 240) -> pd.DataFrame:
@@ -62,44 +162,20 @@ class GlobalFlipFinder:
             DataFrame with columns:
               item_id, name, current_high, current_low
         """
-        window_start = self._get_window_start(since_minutes)
-        if window_start is None:
-            return pd.DataFrame()
-
-        # Subquery to pick the latest scan_ts per item in the window
-        query = """
-            SELECT
-                p.item_id,
-                p.scan_ts,
-                p.high,
-                p.low,
-                i.name
-            FROM prices p
-            JOIN (
-                SELECT item_id, MAX(scan_ts) AS max_ts
-                FROM prices
-                WHERE scan_ts >= ?
-                GROUP BY item_id
-            ) latest
-              ON p.item_id = latest.item_id
-             AND p.scan_ts = latest.max_ts
-            JOIN items i
-              ON p.item_id = i.id
-            WHERE p.high IS NOT NULL
-              AND p.low  IS NOT NULL
-        """
-
-        cur = self.conn.cursor()
-        cur.execute(query, (window_start,))
-        rows = cur.fetchall()
-        if not rows:
+        with self._read_txn():
+            window_start = self._get_window_start(since_minutes)
+            if window_start is None:
+                return pd.DataFrame()
+
+            df = pd.read_sql_query(
+                LATEST_SNAPSHOT_SQL,
+                self.conn,
+                params=(window_start,),
+                dtype=SNAPSHOT_DTYPES,
+            )
+        if df.empty:
             return pd.DataFrame()
 
-        df = pd.DataFrame(
-            rows,
-            columns=["item_id", "scan_ts", "high", "low", "name"],
-        )
-
         df = df.rename(
             columns={
                 "high": "current_high",
@@ -113,7 +189,11 @@ class GlobalFlipFinder:
     # Flip stats                                                         #
     # ------------------------------------------------------------------ #
 
-    def compute_flip_table(self, since_minutes: int = 240) -> pd.DataFrame:
+    def compute_flip_table(
+        self,
+        since_minutes: int = 240,
+        top_n: Optional[int] = None,
+    ) -> pd.DataFrame:
         """
         Compute simple flip stats for all items:
 
@@ -122,44 +202,55 @@ class GlobalFlipFinder:
         - margin
         - roi_pct
 
+        Only items with a positive low and a positive margin are kept.
+        Results are memoized per (latest scan_ts, since_minutes, top_n), so
+        they refresh when a newer snapshot lands in the DB; changes to the
+        items table alone (e.g. a mapping reseed renaming items) show up
+        only after the next snapshot.
+
+        Args:
+            since_minutes: Look-back window in minutes.
+            top_n: Return at most this many rows (None for all).
+
         Returns:
             DataFrame sorted by margin descending.
+
+        Raises:
+            ValueError: If top_n is given and less than 1.
         """
-        df = self.load_latest_snapshot(since_minutes=since_minutes)
+        if top_n is not None and top_n < 1:
+            raise ValueError(f"top_n must be >= 1, got {top_n}")
+
+        with self._read_txn():
+            max_ts = self._get_max_scan_ts()
+            if max_ts is None:
+                return pd.DataFrame()
+
+            table = self._flip_table_cache(max_ts, since_minutes, top_n)
+
+        # Copy so callers can't mutate the cached frame.
+        return table.copy()
+
+    def _query_flip_table(
+        self,
+        max_ts: int,
+        since_minutes: int,
+        top_n: Optional[int],
+    ) -> pd.DataFrame:
+        """Run FLIP_TABLE_SQL for the window ending at max_ts."""
+        window_start = max_ts - since_minutes * 60
+        limit = -1 if top_n is None else top_n
+
+        df = pd.read_sql_query(
+            FLIP_TABLE_SQL,
+            self.conn,
+            params=(window_start, limit),
+            dtype=FLIP_TABLE_DTYPES,
+        )
         if df.empty:
             return pd.DataFrame()
 
-        # Ensure numeric types
-        df["current_high"] = pd.to_numeric(df["current_high"], errors="coerce")
-        df["current_low"] = pd.to_numeric(df["current_low"], errors="coerce")
-
-        # Drop rows with missing or non-positive lows
-        df = df[df["current_low"] > 0]
-
-        # Basic margin
-        df["margin"] = df["current_high"] - df["current_low"]
-
-        # Only keep positive margins
-        df = df[df["margin"] > 0]
-
-        # ROI as percentage
-        df["roi_pct"] = df["margin"] / df["current_low"] * 100.0
-
-        # Sort by margin (biggest absolute GP flips first)
-        df = df.sort_values("margin", ascending=False)
-
-        # Final column order
-        df = df[
-            [
-                "name",
-                "current_high",
-                "current_low",
-                "margin",
-                "roi_pct",
-            ]
-        ]
-
-        return df.reset_index(drop=True)
+        return df
 
     def close(self) -> None:
         """Close the DB connection."""
@@ -175,24 +266,28 @@ def format_table_for_print(df: pd.DataFrame) -> str:
     """
     Pretty-print numeric columns with commas and decimal formatting.
     """
-    df2 = df.copy()
+    int_cols = [
+        col
+        for col in ("current_high", "current_low", "margin")
+        if col in df.columns
+    ]
 
-    int_cols = ["current_high", "current_low", "margin"]
-    for col in int_cols:
-        if col in df2.columns:
-            df2[col] = df2[col].apply(
-                lambda x: "" if pd.isna(x) else f"{int(x):,}"
-            )
+    formatters = {col: "{:,.0f}".format for col in int_cols}
+    if "roi_pct" in df.columns:
+        formatters["roi_pct"] = "{:.2f}%".format
 
-    if "roi_pct" in df2.columns:
-        df2["roi_pct"] = df2["roi_pct"].apply(
-            lambda x: "" if pd.isna(x) else f"{float(x):.2f}%"
-        )
+    # Nullable ints render missing values as "<NA>" whatever na_rep says;
+    # as float64 (exact for any GP amount) they honour it.
+    na_cols = [col for col in int_cols if df[col].hasnans]
+    if na_cols:
+        df = df.astype({col: "float64" for col in na_cols})
 
-    if "name" in df2.columns:
-        df2["name"] = df2["name"].astype(str)
+    # na_rep="" is meant for the numbers only; a missing name still prints
+    # as "None".
+    if "name" in df.columns and df["name"].hasnans:
+        df = df.assign(name=df["name"].fillna("None"))
 
-    return df2.to_string(index=False)
+    return df.to_string(index=False, na_rep="", formatters=formatters)
 
 
 # ---------------------------------------------------------------------- #
@@ -218,12 +313,14 @@ def main() -> None:
             try:
                 top_n = int(top_str)
             except ValueError:
+                top_n = 0
+            if top_n < 1:
                 print("Invalid number; using 20.")
                 top_n = 20
         else:
             top_n = 20
 
-        table = finder.compute_flip_table(since_minutes=window)
+        table = finder.compute_flip_table(since_minutes=window, top_n=top_n)
         if table.empty:
             print("No data available in the selected window.")
             return
@@ -232,7 +329,7 @@ def main() -> None:
             f"\n=== Top {top_n} flip candidates "
             f"over last {window} minutes ===\n"
         )
-        pretty = format_table_for_print(table.head(top_n))
+        pretty = format_table_for_print(table)
         print(pretty)
     finally:
         finder.close()
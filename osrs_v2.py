@@ -4,7 +4,8 @@ OSRS price collector.
 
 - Fetches item mapping from https://prices.runescape.wiki/api/v1/osrs/mapping
 - Periodically pulls /latest prices and stores them in SQLite.
-- Designed to be run every minute via cron.
+- Designed to be run every minute via cron, or as a long-running
+  process via OsrsPriceCollector.run_forever().
 
 Usage (manual):
     python collector.py
@@ -12,14 +13,24 @@ Usage (manual):
 
 from __future__ import annotations
 
+import json
 import logging
 import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Iterable
+from typing import Any, Dict, List
 
 import requests
 
+try:  # orjson decodes the multi-MB /latest payload several times faster.
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 
 LOGGER = logging.getLogger(__name__)
 
@@ -31,6 +42,14 @@ DEFAULT_HEADERS: Dict[str, str] = {
     "User-Agent": "osrs-trading-platform/0.1 (contact: rhoades.lorenzo@gmail.com)"
 }
 
+# Statements run for every stored snapshot.
+INSERT_PRICES_SQL = """
+    INSERT INTO prices (scan_ts, item_id, high, low, highTime, lowTime)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (scan_ts, item_id) DO NOTHING
+"""
+MAX_SCAN_TS_SQL = "SELECT MAX(scan_ts) FROM prices"
+
 
 class OsrsPriceCollector:
     """
@@ -78,6 +97,9 @@ class OsrsPriceCollector:
         conn = sqlite3.connect(self.db_path)
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA cache_size=-65536;")  # 64 MiB
+        conn.execute("PRAGMA wal_autocheckpoint=1000;")
         return conn
 
     @property
@@ -87,7 +109,7 @@ class OsrsPriceCollector:
         return self._conn
 
     def _create_tables(self) -> None:
-        """Create the items and prices tables if they don't exist."""
+        """Create the items and prices tables (and indexes) if they don't exist."""
         cur = self.conn.cursor()
 
         cur.execute(
@@ -119,8 +141,27 @@ class OsrsPriceCollector:
             """
         )
 
+        # Lets MAX(scan_ts) ... GROUP BY item_id walk the index per item
+        # instead of scanning the whole window.
+        cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_prices_item_ts'"
+        )
+        index_is_new = cur.fetchone() is None
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_prices_item_ts
+            ON prices (item_id, scan_ts DESC)
+            """
+        )
+
         self.conn.commit()
 
+        # Without stats the planner scans the new index over the whole
+        # history; give existing DBs stats right away rather than at the
+        # next day's refresh.
+        if index_is_new:
+            self._refresh_planner_stats()
+
     # --------------------------------------------------------------------- #
     # Mapping logic                                                         #
     # --------------------------------------------------------------------- #
@@ -178,12 +219,26 @@ class OsrsPriceCollector:
         Returns:
             Number of rows inserted into the prices table.
         """
+        scan_ts, latest = self._fetch_latest()
+        return self._store_snapshot(scan_ts, latest)
+
+    def _fetch_latest(self) -> tuple[int, Dict[str, Dict[str, Any]]]:
+        """
+        Fetch /latest.
+
+        Returns:
+            (scan_ts, {item_id_str: payload}) where scan_ts is the time of
+            the fetch in unix seconds.
+        """
         LOGGER.info("Fetching /latest prices...")
         data = self._fetch_json(self.latest_url)
-        latest: Dict[str, Dict[str, Any]] = data["data"]
-        scan_ts = int(time.time())
+        return int(time.time()), data["data"]
 
-        rows: Iterable[tuple[int, int, int | None, int | None, int | None, int | None]] = (
+    def _store_snapshot(
+        self, scan_ts: int, latest: Dict[str, Dict[str, Any]]
+    ) -> int:
+        """Insert one /latest payload into the prices table."""
+        rows: List[tuple[int, int, int | None, int | None, int | None, int | None]] = [
             (
                 scan_ts,
                 int(item_id_str),
@@ -193,22 +248,73 @@ class OsrsPriceCollector:
                 payload.get("lowTime"),
             )
             for item_id_str, payload in latest.items()
-        )
+        ]
 
-        cur = self.conn.cursor()
-        cur.executemany(
-            """
-            INSERT OR IGNORE INTO prices (scan_ts, item_id, high, low, highTime, lowTime)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            rows,
-        )
-        self.conn.commit()
+        stats_stale = self._planner_stats_stale(scan_ts)
+
+        # Commit the snapshot as one unit, or roll the whole batch back if
+        # any insert fails.
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.executemany(INSERT_PRICES_SQL, rows)
 
         inserted = cur.rowcount if cur.rowcount is not None else 0
         LOGGER.info("Stored snapshot @ %d (rows inserted: %d).", scan_ts, inserted)
+
+        if stats_stale:
+            self._refresh_planner_stats()
+
         return inserted
 
+    def _planner_stats_stale(self, scan_ts: int) -> bool:
+        """
+        True when scan_ts is the first snapshot of a new UTC day, or when
+        prices has no planner stats yet.
+        """
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        )
+        if cur.fetchone() is None:
+            return True
+
+        cur.execute("SELECT 1 FROM sqlite_stat1 WHERE tbl = 'prices'")
+        if cur.fetchone() is None:
+            return True
+
+        cur.execute(MAX_SCAN_TS_SQL)
+        (prev_ts,) = cur.fetchone()
+        return prev_ts is None or prev_ts // 86400 != scan_ts // 86400
+
+    def _refresh_planner_stats(self) -> None:
+        """
+        ANALYZE the prices table.
+
+        Without stats the planner walks idx_prices_item_ts across the whole
+        history for flip_finder's window queries; with them it skip-scans
+        straight to each item's recent rows. analysis_limit bounds the
+        cost to a sample, so this stays cheap as the table grows.
+        """
+        LOGGER.info("Refreshing query planner statistics...")
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA analysis_limit=1000;")
+        cur.execute("ANALYZE prices;")
+        self.conn.commit()
+
+    def _fetch_latest_at(
+        self, when: float, stop: threading.Event
+    ) -> tuple[int, Dict[str, Dict[str, Any]]] | None:
+        """
+        Wait until the monotonic time `when`, then fetch /latest.
+
+        Runs on a worker thread; fetching /latest does not touch the DB.
+        Returns None without fetching if `stop` is set while waiting.
+        """
+        if stop.wait(max(0.0, when - time.monotonic())):
+            return None
+
+        return self._fetch_latest()
+
     # --------------------------------------------------------------------- #
     # Public API                                                            #
     # --------------------------------------------------------------------- #
@@ -226,6 +332,48 @@ class OsrsPriceCollector:
         self.seed_mapping_if_needed()
         self.collect_latest_snapshot()
 
+    def run_forever(self, interval_seconds: float = 60.0) -> None:
+        """
+        Long-running alternative to cron + run_once.
+
+        Stores a /latest snapshot every `interval_seconds`. The next fetch
+        runs on a worker thread while the main thread commits the previous
+        snapshot, so a slow commit does not delay the next scheduled fetch.
+        A failed fetch or store is logged and the loop carries on with the
+        next tick, as a failed cron run would.
+        """
+        _ = self.conn
+        self._create_tables()
+        self.seed_mapping_if_needed()
+
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            next_tick = time.monotonic()
+            pending = pool.submit(self._fetch_latest_at, next_tick, stop)
+            while True:
+                try:
+                    snapshot = pending.result()
+                except Exception:
+                    LOGGER.exception("Fetching /latest failed; retrying next tick.")
+                    snapshot = None
+
+                # Don't burst through missed ticks after a slow fetch.
+                next_tick = max(next_tick + interval_seconds, time.monotonic())
+                pending = pool.submit(self._fetch_latest_at, next_tick, stop)
+
+                if snapshot is None:
+                    continue
+                try:
+                    self._store_snapshot(*snapshot)
+                except Exception:
+                    LOGGER.exception("Storing snapshot failed; skipping it.")
+        finally:
+            # Wake a worker that is waiting for its tick so shutdown (e.g. on
+            # Ctrl-C) doesn't block for up to interval_seconds.
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
     # --------------------------------------------------------------------- #
     # HTTP helper                                                           #
     # --------------------------------------------------------------------- #
@@ -234,7 +382,7 @@ class OsrsPriceCollector:
         """GET JSON with basic error handling."""
         response = requests.get(url, headers=self.headers, timeout=10)
         response.raise_for_status()
-        return response.json()
+        return _json_loads(response.content)
 
 
 def main() -> None: